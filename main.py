@@ -2,10 +2,22 @@ from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
 from datetime import datetime, timedelta
 import pytz
+import asyncio
+import io
 import logging
 import os
-import json
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import msgpack
+import msgspec
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - fall back to the stdlib encoder
+    orjson = None
+    import json
 
 # Configure logging
 logging.basicConfig(
@@ -14,19 +26,98 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Sync message logs to disk after this many new messages or this many seconds
+FLUSH_BATCH_SIZE = 100
+FLUSH_INTERVAL = 5
+LOG_BUFFER_SIZE = 64 * 1024
+
+# Number of message logs kept open at once
+LOG_FILE_LIMIT = 64
+
+# Number of groups whose message index is kept in memory
+INDEX_CACHE_SIZE = 64
+
+# Repairing a damaged log: records that must decode in a row to resume after damage,
+# bytes each probe may need, and how much of the log is read at a time
+RESYNC_RUN = 3
+RESYNC_PROBE_SIZE = 64 * 1024
+RESYNC_WINDOW_SIZE = 1024 * 1024
+
+GROUP_CHAT_TYPES = frozenset({'group', 'supergroup'})
+
+class MessageRecord(msgspec.Struct, array_like=True):
+    """A tracked group message, stored as [user_id, username, timestamp, text]."""
+    user_id: int
+    username: Optional[str]
+    timestamp: int
+    text: str
+
+class TimestampArray:
+    """Sorted int64 timestamps in a numpy buffer that grows by doubling."""
+    __slots__ = ('_data', '_size')
+
+    def __init__(self, timestamps=()):
+        self._data = np.sort(np.asarray(timestamps, dtype=np.int64))
+        self._size = len(self._data)
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, timestamp):
+        """Insert a timestamp, keeping the array sorted."""
+        if self._size == len(self._data):
+            grown = np.empty(max(8, 2 * self._size), dtype=np.int64)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        if self._size == 0 or timestamp >= self._data[self._size - 1]:
+            # Messages almost always arrive in order, so this is the common case
+            self._data[self._size] = timestamp
+        else:
+            pos = int(np.searchsorted(self._data[:self._size], timestamp, side='right'))
+            self._data[pos + 1:self._size + 1] = self._data[pos:self._size]
+            self._data[pos] = timestamp
+        self._size += 1
+
+    def count_between(self, start, end):
+        """Count timestamps in the inclusive range [start, end]."""
+        timestamps = self._data[:self._size]
+        return int(np.searchsorted(timestamps, end, side='right') - np.searchsorted(timestamps, start, side='left'))
+
 class MessageCounterBot:
     def __init__(self, token):
-        self.application = Application.builder().token(token).build()
+        self.application = Application.builder().token(token).post_shutdown(self.on_shutdown).build()
         self.data_dir = "bot_data"
+        self.messages_dir = os.path.join(self.data_dir, "msgs")
         self.ensure_data_directory()
+
+        # Reused for every message instead of building an encoder per call
+        self._encoder = msgspec.msgpack.Encoder()
+        self._jsonl_decoder = msgspec.json.Decoder(MessageRecord)
         
-        # Load saved data
-        self.message_history = self.load_messages()
-        self.admin_users = self.load_data('admin_users.json', set())
+        # Load saved data; message logs are read lazily per group
+        self.admin_users = {int(user_id) for user_id in self.load_data('admin_users.json', [])}
         self.group_names = self.load_data('group_names.json', {})
-        
-        # Convert set from loaded JSON
-        self.admin_users = set(self.admin_users)
+        self._admins_dirty = False
+        self._group_names_dirty = False
+
+        # LRU cache of group_id -> {username: TimestampArray}, so counts are two binary searches
+        self._user_index_cache = OrderedDict()
+        # group_id -> (load task, messages tracked while the log is being read)
+        self._index_loads = {}
+
+        # LRU of open message logs, only touched on the I/O thread; writes are buffered and synced in batches
+        self._log_files = OrderedDict()
+        # Groups whose log was checked for a torn tail since startup, also only touched on the I/O thread
+        self._checked_logs = set()
+
+        # Convert logs left by older versions; this runs before the I/O thread is in use
+        self.migrate_message_history()
+        self.migrate_jsonl_logs()
+        self._dirty_groups = set()
+        self._pending_writes = 0
+
+        # Blocking file writes run on a single thread so they stay off the event loop and in order
+        self._io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-io")
         
         # Register handlers
         self.application.add_handler(CommandHandler("start", self.start))
@@ -40,67 +131,455 @@ class MessageCounterBot:
         # Error handler
         self.application.add_error_handler(self.error_callback)
 
+        # Periodically flush buffered messages
+        if self.application.job_queue is not None:
+            self.application.job_queue.run_repeating(self.flush_job, interval=FLUSH_INTERVAL)
+        else:
+            logger.warning("Job queue unavailable; messages are only flushed in batches and on shutdown")
+
     def ensure_data_directory(self):
         """Create data directory if it doesn't exist."""
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
+        if not os.path.exists(self.messages_dir):
+            os.makedirs(self.messages_dir)
+
+    @staticmethod
+    def _loads(raw):
+        """Decode JSON bytes, preferring orjson when it is available."""
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw.decode('utf-8'))
+
+    @staticmethod
+    def _dumps(data):
+        """Encode data as compact UTF-8 JSON bytes, preferring orjson when it is available."""
+        if orjson is not None:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def messages_path(self, group_id):
+        """Return the path of a group's append-only message log."""
+        return os.path.join(self.messages_dir, f'{group_id}.msgpack')
+
+    async def get_user_index(self, group_id):
+        """Return a group's timestamp index, loading it from its log on the I/O thread on first use."""
+        user_ts = self._user_index_cache.get(group_id)
+        if user_ts is not None:
+            self._user_index_cache.move_to_end(group_id)
+            return user_ts
+
+        load = self._index_loads.get(group_id)
+        if load is None:
+            # Submit the read right away so writes for messages tracked from now on queue behind it
+            future = asyncio.get_running_loop().run_in_executor(self._io_executor, self.load_user_index, group_id)
+            arrived = []
+            load = (asyncio.ensure_future(self.cache_user_index(group_id, future, arrived)), arrived)
+            self._index_loads[group_id] = load
+        return await asyncio.shield(load[0])
+
+    async def cache_user_index(self, group_id, future, arrived):
+        """Finish loading a group's index and add it to the LRU cache."""
+        try:
+            user_ts = await future
+        finally:
+            del self._index_loads[group_id]
+        for username, timestamp in arrived:
+            user_ts[username].insert(timestamp)
+        if group_id in self.group_names:
+            self._user_index_cache[group_id] = user_ts
+            if len(self._user_index_cache) > INDEX_CACHE_SIZE:
+                self._user_index_cache.popitem(last=False)
+        return user_ts
+
+    def index_message(self, group_id, message):
+        """Add a message to its group's index if that index is cached or being loaded."""
+        user_ts = self._user_index_cache.get(group_id)
+        if user_ts is not None:
+            user_ts[message.username].insert(message.timestamp)
+            return
+        load = self._index_loads.get(group_id)
+        if load is not None:
+            load[1].append((message.username, message.timestamp))
+
+    def load_user_index(self, group_id):
+        """Read a group's log and index its sorted message timestamps by username."""
+        timestamps_by_user = defaultdict(list)
+        self.check_log(group_id)
+        log_file = self._log_files.get(group_id)
+        if log_file is not None:
+            # Include records still sitting in the write buffer
+            log_file.flush()
+        try:
+            with open(self.messages_path(group_id), 'rb') as f:
+                for msg in self.iter_messages(f):
+                    timestamps_by_user[msg.username].append(msg.timestamp)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading message history for group {group_id}: {e}")
+        user_ts = defaultdict(TimestampArray)
+        for username, timestamps in timestamps_by_user.items():
+            user_ts[username] = TimestampArray(timestamps)
+        return user_ts
+
+    def encode_messages(self, messages):
+        """Encode messages as a stream of MessagePack records."""
+        return b''.join(self._encoder.encode(message) for message in messages)
+
+    @staticmethod
+    def iter_messages(f):
+        """Decode a stream of MessagePack records from an open log file, stopping at a damaged record."""
+        try:
+            for row in msgpack.Unpacker(f, raw=False):
+                yield MessageRecord(*row)
+        except Exception as e:
+            logger.error(f"Stopped reading damaged log {f.name}: {e}")
+
+    @staticmethod
+    def scan_records(f, start):
+        """Return the offset just past the last complete, well-formed record read from start."""
+        f.seek(start)
+        unpacker = msgpack.Unpacker(f, raw=False)
+        end = start
+        try:
+            for row in unpacker:
+                msgspec.convert(row, MessageRecord)
+                end = start + unpacker.tell()
+        except Exception:
+            pass
+        return end
+
+    @staticmethod
+    def probe_records(window, offset, at_eof):
+        """Check whether a short run of well-formed records starts at offset in window."""
+        buf = io.BytesIO(window)
+        buf.seek(offset)
+        unpacker = msgpack.Unpacker(buf, raw=False, read_size=4096)
+        count = 0
+        try:
+            for row in unpacker:
+                msgspec.convert(row, MessageRecord)
+                count += 1
+                if count == RESYNC_RUN:
+                    return True
+        except Exception:
+            return False
+        # Fewer records than a full run are only trusted if they end exactly at the end of the log
+        return count > 0 and (not at_eof or offset + unpacker.tell() == len(window))
+
+    def resync(self, f, pos, size):
+        """Return the first offset from pos where records decode cleanly again, or size if none does."""
+        window_start, window = pos, b''
+        while pos < size:
+            window_end = window_start + len(window)
+            if pos + RESYNC_PROBE_SIZE > window_end and window_end < size:
+                f.seek(pos)
+                window_start, window = pos, f.read(RESYNC_WINDOW_SIZE)
+            if self.probe_records(window, pos - window_start, window_start + len(window) == size):
+                return pos
+            pos += 1
+        return size
+
+    @staticmethod
+    def copy_range(src, dst, start, end):
+        """Copy bytes [start, end) of src to dst in bounded chunks."""
+        src.seek(start)
+        remaining = end - start
+        while remaining:
+            chunk = src.read(min(remaining, RESYNC_WINDOW_SIZE))
+            dst.write(chunk)
+            remaining -= len(chunk)
+
+    def check_log(self, group_id):
+        """Repair a group's log the first time it is used after startup.
+
+        A crash can leave a partly written record in the log, and older logs may
+        have records appended after such a tear. Each damaged stretch is cut out
+        and reading resumes at the next offset where well-formed records decode
+        again, so good records on either side of a tear are kept.
+        """
+        if group_id in self._checked_logs:
+            return
+        self._checked_logs.add(group_id)
+        file_path = self.messages_path(group_id)
+        try:
+            with open(file_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                kept = []
+                pos = 0
+                while pos < size:
+                    end = self.scan_records(f, pos)
+                    if end > pos:
+                        kept.append((pos, end))
+                    if end >= size:
+                        break
+                    pos = self.resync(f, end + 1, size)
+                kept_size = sum(end - start for start, end in kept)
+                if kept_size == size:
+                    return
+                tmp_path = file_path + '.tmp'
+                with open(tmp_path, 'wb') as out:
+                    for start, end in kept:
+                        self.copy_range(f, out, start, end)
+                    out.flush()
+                    os.fsync(out.fileno())
+            os.replace(tmp_path, file_path)
+            logger.warning(f"Dropped {size - kept_size} damaged bytes from the message log of group {group_id}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error checking message log for group {group_id}: {e}")
+
+    def decode_jsonl(self, raw):
+        """Decode a legacy JSONL group log, including its older dict-per-line records.
 
-    def load_messages(self):
-        """Load message history from JSON file with proper defaultdict handling."""
+        Lines that cannot be decoded, such as one torn by a crash, are skipped.
+        """
+        decoder = self._jsonl_decoder
+        try:
+            return decoder.decode_lines(raw)
+        except msgspec.DecodeError:
+            pass
+
+        messages = []
+        skipped = 0
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                messages.append(decoder.decode(line))
+                continue
+            except msgspec.ValidationError:
+                pass
+            except msgspec.DecodeError:
+                skipped += 1
+                continue
+            try:
+                messages.append(self.message_from_dict(self._loads(line)))
+            except Exception:
+                skipped += 1
+        if skipped:
+            logger.warning(f"Skipped {skipped} undecodable lines in a legacy message log")
+        return messages
+
+    @staticmethod
+    def message_from_dict(data):
+        """Build a record from the legacy dict message format."""
+        return MessageRecord(data['user_id'], data['username'], int(data['timestamp']), data['text'])
+
+    def merge_into_log(self, group_id, messages):
+        """Write migrated records ahead of the records already in a group's log.
+
+        A log that already starts with exactly these records is left alone, so a
+        migration interrupted before its legacy source was removed can be rerun
+        without duplicating messages.
+        """
+        self.check_log(group_id)
+        file_path = self.messages_path(group_id)
+        tmp_path = file_path + '.tmp'
+        migrated = self.encode_messages(messages)
+        if not os.path.exists(file_path):
+            existing_size = 0
+        else:
+            existing_size = os.path.getsize(file_path)
+            with open(file_path, 'rb') as f:
+                if f.read(len(migrated)) == migrated:
+                    return
+        with open(tmp_path, 'wb') as out:
+            out.write(migrated)
+            if existing_size:
+                with open(file_path, 'rb') as f:
+                    self.copy_range(f, out, 0, existing_size)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, file_path)
+
+    def migrate_message_history(self):
+        """Split a legacy message_history.json into per-group logs."""
         file_path = os.path.join(self.data_dir, 'message_history.json')
-        message_history = defaultdict(list)
-        
+        if not os.path.exists(file_path):
+            return
         try:
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    for group_id, messages in data.items():
-                        message_history[group_id] = messages
+            with open(file_path, 'rb') as f:
+                data = self._loads(f.read())
+            # Convert everything first so malformed input aborts before any log is touched
+            converted = {
+                group_id: [self.message_from_dict(message) for message in messages]
+                for group_id, messages in data.items()
+            }
+            for group_id, messages in converted.items():
+                self.merge_into_log(group_id, messages)
+            os.remove(file_path)
+            logger.info("Migrated message_history.json to per-group logs")
         except Exception as e:
-            logger.error(f"Error loading message history: {e}")
-        
-        return message_history
+            logger.error(f"Error migrating message history: {e}")
+
+    def migrate_jsonl_logs(self):
+        """Convert legacy per-group JSONL logs to MessagePack."""
+        for filename in os.listdir(self.messages_dir):
+            if not filename.endswith('.jsonl'):
+                continue
+            group_id = filename[:-len('.jsonl')]
+            file_path = os.path.join(self.messages_dir, filename)
+            try:
+                with open(file_path, 'rb') as f:
+                    messages = self.decode_jsonl(f.read())
+                self.merge_into_log(group_id, messages)
+                os.remove(file_path)
+                logger.info(f"Migrated {filename} to MessagePack")
+            except Exception as e:
+                logger.error(f"Error migrating {filename}: {e}")
 
     def load_data(self, filename, default_value):
         """Load data from JSON file."""
         file_path = os.path.join(self.data_dir, filename)
         try:
             if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(file_path, 'rb') as f:
+                    return self._loads(f.read())
         except Exception as e:
             logger.error(f"Error loading {filename}: {e}")
         return default_value
 
-    def save_messages(self):
-        """Save message history to JSON file."""
-        file_path = os.path.join(self.data_dir, 'message_history.json')
+    def log_file(self, group_id):
+        """Return the open, buffered append handle for a group's message log.
+
+        Past LOG_FILE_LIMIT the least recently used handle is synced and closed.
+        """
+        f = self._log_files.get(group_id)
+        if f is not None:
+            self._log_files.move_to_end(group_id)
+            return f
+        self.check_log(group_id)
+        f = open(self.messages_path(group_id), 'ab', buffering=LOG_BUFFER_SIZE)
+        self._log_files[group_id] = f
+        if len(self._log_files) > LOG_FILE_LIMIT:
+            _, oldest = self._log_files.popitem(last=False)
+            self.sync_logs([oldest])
+            self.close_logs([oldest])
+        return f
+
+    def write_message(self, group_id, payload):
+        """Append an encoded record to a group's log buffer."""
+        try:
+            self.log_file(group_id).write(payload)
+        except Exception as e:
+            logger.error(f"Error saving message for group {group_id}: {e}")
+
+    async def append_message(self, group_id, message):
+        """Append a message to a group's log as a MessagePack record."""
+        await self.run_io(self.write_message, group_id, self._encoder.encode(message))
+
+    def sync_groups(self, group_ids):
+        """Flush and fsync the open logs of the given groups."""
+        self.sync_logs([self._log_files[group_id] for group_id in group_ids if group_id in self._log_files])
+
+    def close_all_logs(self):
+        """Close every open log handle."""
+        log_files = list(self._log_files.values())
+        self._log_files.clear()
+        self.close_logs(log_files)
+
+    @staticmethod
+    def sync_logs(log_files):
+        """Flush buffered log writes and fsync them to disk."""
+        for f in log_files:
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+            except Exception as e:
+                logger.error(f"Error syncing {f.name}: {e}")
+
+    @staticmethod
+    def close_logs(log_files):
+        """Close log handles, flushing anything still buffered."""
+        for f in log_files:
+            try:
+                f.close()
+            except Exception as e:
+                logger.error(f"Error closing {f.name}: {e}")
+
+    def remove_messages(self, group_id):
+        """Close and delete a group's message log."""
+        log_file = self._log_files.pop(group_id, None)
+        self._checked_logs.discard(group_id)
+        if log_file is not None:
+            self.close_logs([log_file])
         try:
-            message_dict = dict(self.message_history)
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(message_dict, f, ensure_ascii=False, indent=2)
-            logger.info("Messages saved successfully")
+            os.remove(self.messages_path(group_id))
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            logger.error(f"Error saving message history: {e}")
+            logger.error(f"Error removing messages for group {group_id}: {e}")
 
-    def save_data(self, filename, data):
-        """Save data to JSON file."""
+    def write_file(self, filename, payload):
+        """Write encoded bytes to a file in the data directory, returning whether it succeeded."""
         file_path = os.path.join(self.data_dir, filename)
         try:
-            if isinstance(data, set):
-                data = list(data)
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with open(file_path, 'wb') as f:
+                f.write(payload)
+            return True
         except Exception as e:
             logger.error(f"Error saving {filename}: {e}")
+            return False
+
+    async def run_io(self, func, *args):
+        """Run blocking file I/O on the I/O thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._io_executor, func, *args)
+
+    async def save_data(self, filename, data):
+        """Save data to JSON file, returning whether it succeeded."""
+        if isinstance(data, set):
+            data = list(data)
+        # Encode on the event loop so the snapshot can't change mid-write
+        return await self.run_io(self.write_file, filename, self._dumps(data))
+
+    async def save_admins(self):
+        """Save admin_users.json, leaving it marked dirty for the next flush if the write fails."""
+        self._admins_dirty = False
+        if not await self.save_data('admin_users.json', self.admin_users):
+            self._admins_dirty = True
+
+    async def save_group_names(self):
+        """Save group_names.json, leaving it marked dirty for the next flush if the write fails."""
+        self._group_names_dirty = False
+        if not await self.save_data('group_names.json', self.group_names):
+            self._group_names_dirty = True
+
+    async def update_group_name(self, group_id, title):
+        """Record a group's title, saving only when it changed."""
+        if self.group_names.get(group_id) != title:
+            self.group_names[group_id] = title
+            await self.save_group_names()
+
+    async def flush(self):
+        """Retry failed admin and group name saves and sync message logs written since the last flush."""
+        if self._admins_dirty:
+            await self.save_admins()
+        if self._group_names_dirty:
+            await self.save_group_names()
+        if not self._dirty_groups:
+            return
+        group_ids = self._dirty_groups
+        self._dirty_groups = set()
+        self._pending_writes = 0
+        await self.run_io(self.sync_groups, group_ids)
+
+    async def flush_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Flush buffered messages from the job queue."""
+        await self.flush()
+
+    async def on_shutdown(self, application: Application):
+        """Flush buffered messages before the bot exits."""
+        await self.flush()
+        await self.run_io(self.close_all_logs)
+        self._io_executor.shutdown(wait=True)
 
     async def handle_new_chat_members(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle when bot is added to a new group."""
         for member in update.message.new_chat_members:
             if member.id == context.bot.id:
                 group_id = str(update.message.chat_id)
-                self.group_names[group_id] = update.message.chat.title
-                self.save_data('group_names.json', self.group_names)
+                await self.update_group_name(group_id, update.message.chat.title)
                 logger.info(f"Bot added to group: {update.message.chat.title} (ID: {group_id})")
                 await update.message.reply_text("Thanks for adding me! I'll start tracking messages now.")
 
@@ -110,10 +589,10 @@ class MessageCounterBot:
             group_id = str(update.message.chat_id)
             if group_id in self.group_names:
                 del self.group_names[group_id]
-                if group_id in self.message_history:
-                    del self.message_history[group_id]
-                self.save_data('group_names.json', self.group_names)
-                self.save_messages()
+                self._user_index_cache.pop(group_id, None)
+                self._dirty_groups.discard(group_id)
+                await self.save_group_names()
+                await self.run_io(self.remove_messages, group_id)
                 logger.info(f"Bot removed from group: {update.message.chat.title} (ID: {group_id})")
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -129,21 +608,26 @@ class MessageCounterBot:
             )
         else:
             group_id = str(update.message.chat_id)
-            self.group_names[group_id] = update.message.chat.title
-            self.save_data('group_names.json', self.group_names)
+            await self.update_group_name(group_id, update.message.chat.title)
             await update.message.reply_text('Bot is ready to track messages in this group.')
 
     async def authorize(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Authorize a user to use the bot."""
         if update.message.chat.type == 'private':
             user_id = update.message.from_user.id
-            self.admin_users.add(user_id)
-            self.save_data('admin_users.json', self.admin_users)
+            if user_id not in self.admin_users:
+                self.admin_users.add(user_id)
+                await self.save_admins()
             await update.message.reply_text('You are now authorized to use the bot.')
 
+    def is_authorized(self, update: Update):
+        """Check that a command comes from an authorized admin in a private chat."""
+        message = update.message
+        return message.chat.type == 'private' and message.from_user.id in self.admin_users
+
     async def list_groups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """List all groups the bot is in."""
-        if update.message.chat.type != 'private' or update.message.from_user.id not in self.admin_users:
+        if not self.is_authorized(update):
             await update.message.reply_text('You need to be authorized to use this command. Use /authorize first.')
             return
 
@@ -160,24 +644,28 @@ class MessageCounterBot:
 
     async def track_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Track each message in the group."""
-        if update.message.chat.type in ['group', 'supergroup']:
-            message_data = {
-                'user_id': update.message.from_user.id,
-                'username': update.message.from_user.username,
-                'timestamp': update.message.date.timestamp(),
-                'text': update.message.text
-            }
+        if update.message.chat.type in GROUP_CHAT_TYPES:
+            message_data = MessageRecord(
+                update.message.from_user.id,
+                update.message.from_user.username,
+                int(update.message.date.timestamp()),
+                update.message.text
+            )
             group_id = str(update.message.chat_id)
-            self.message_history[group_id].append(message_data)
-            self.group_names[group_id] = update.message.chat.title
-            
-            # Save messages immediately
-            self.save_messages()
-            self.save_data('group_names.json', self.group_names)
+            # Uncached groups are only appended to; their index is read from the log when queried
+            self.index_message(group_id, message_data)
+            await self.append_message(group_id, message_data)
+            self._dirty_groups.add(group_id)
+            self._pending_writes += 1
+
+            await self.update_group_name(group_id, update.message.chat.title)
+
+            if self._pending_writes >= FLUSH_BATCH_SIZE:
+                await self.flush()
 
     async def count_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Count messages for a specific user within a date range."""
-        if update.message.chat.type != 'private' or update.message.from_user.id not in self.admin_users:
+        if not self.is_authorized(update):
             await update.message.reply_text('You need to be authorized to use this command. Use /authorize first.')
             return
 
@@ -190,25 +678,20 @@ class MessageCounterBot:
                 return
 
             group_id = str(int(context.args[0]))
+            if group_id not in self.group_names:
+                await update.message.reply_text('Error: Bot is not in this group or group ID is invalid.')
+                return
+
             username = context.args[1].replace('@', '')
             start_date = datetime.strptime(context.args[2], '%Y-%m-%d').replace(tzinfo=pytz.UTC)
             end_date = datetime.strptime(context.args[3], '%Y-%m-%d').replace(tzinfo=pytz.UTC)
             end_date = end_date + timedelta(days=1)  # Include the entire end date
-
-            if group_id not in self.group_names:
-                await update.message.reply_text('Error: Bot is not in this group or group ID is invalid.')
-                return
             
             # Count messages
-            message_count = 0
-            start_timestamp = start_date.timestamp()
-            end_timestamp = end_date.timestamp()
-            
-            for msg in self.message_history[group_id]:
-                msg_timestamp = float(msg['timestamp'])
-                if (msg['username'] == username and 
-                    start_timestamp <= msg_timestamp <= end_timestamp):
-                    message_count += 1
+            start_timestamp = int(start_date.timestamp())
+            end_timestamp = int(end_date.timestamp())
+            timestamps = (await self.get_user_index(group_id)).get(username)
+            message_count = timestamps.count_between(start_timestamp, end_timestamp) if timestamps else 0
 
             group_name = self.group_names.get(group_id, 'Unknown Group')
             response = (f"In group '{group_name}':\n"